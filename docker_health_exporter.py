@@ -5,8 +5,12 @@ import docker
 import threading
 import markdown
 import json
+import operator
+from concurrent.futures import ThreadPoolExecutor, wait
 from flask import Flask, render_template, Response
-from prometheus_client import Gauge, generate_latest, REGISTRY, CONTENT_TYPE_LATEST
+from prometheus_client import generate_latest, REGISTRY, CONTENT_TYPE_LATEST
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
 
 # Configure logging based on environment variable
 log_level_name = os.environ.get("LOG_LEVEL", "info").upper()
@@ -34,6 +38,11 @@ except json.JSONDecodeError as e:
     logger.error(f"Failed to parse LABEL_MAPPINGS environment variable: {e}")
     logger.error(f"Using default empty mapping. LABEL_MAPPINGS was: {LABEL_MAPPINGS_ENV}")
 
+# Container label to metric label pairs, iterated for every container
+_LABEL_MAP_ITEMS = tuple(LABEL_MAPPINGS.items())
+# Most deployments configure no mappings, which lets the mapping step be skipped
+_HAS_CUSTOM_LABELS = bool(_LABEL_MAP_ITEMS)
+
 # Define base labels for metrics
 BASE_LABELS = ['container_id', 'container_name', 'image', 'stack', 'service']
 
@@ -51,19 +60,8 @@ if NO_DEFAULT_LABELS:
 else:
     ALL_LABELS = BASE_LABELS + CUSTOM_LABELS
 
-# Prometheus metrics with dynamic labels
-CONTAINER_HEALTH = Gauge(
-    'docker_container_health_status',
-    'Health status of Docker containers with health checks (0=unhealthy, 1=healthy, 2=starting, 3=no health check)',
-    ALL_LABELS
-)
-
-# Health failure streak metric
-HEALTH_FAILURE_STREAK = Gauge(
-    'docker_container_health_failure_streak',
-    'Number of consecutive health check failures for Docker containers',
-    ALL_LABELS
-)
+# Fixed order of the metric label values
+_LABEL_ORDER = tuple(ALL_LABELS)
 
 # Health status mapping
 HEALTH_STATUS = {
@@ -73,24 +71,143 @@ HEALTH_STATUS = {
     'none': 3
 }
 
-class DockerHealthCollector:
+# Docker events that can change which containers are tracked or their health
+EVENT_FILTERS = {
+    'type': ['container'],
+    'event': ['start', 'die', 'destroy', 'health_status']
+}
+
+def _build_filters():
+    """
+    Build server-side filters for listing containers.
+
+    Returns:
+        dict: Filters for the Docker API, or None to list all running containers
+    """
+    if OPT_IN_ONLY:
+        # Let the daemon drop containers without the opt-in label. The daemon matches
+        # values case-sensitively, so should_monitor_container still checks the value.
+        return {'label': ['prometheus.health.enabled']}
+    return None
+
+def _container_name(container):
+    """Return the name of a container from its API summary, without the leading slash."""
+    names = container.get('Names') or []
+    return names[0].lstrip('/') if names else 'unknown'
+
+def _make_label_extractor(label_order):
+    """
+    Build a function that returns a container's metric label values in order.
+
+    The label set is fixed at import time, so the key lookups are bound once
+    instead of looping over the label names for every container. The returned
+    function expects every label to be present in the container data.
+
+    Args:
+        label_order (tuple): Metric label names
+
+    Returns:
+        callable: Maps container health data to a tuple of label values
+    """
+    if len(label_order) == 1:
+        # itemgetter with a single key returns the bare value, not a tuple
+        label_name = label_order[0]
+        return lambda container_data: (container_data[label_name],)
+    return operator.itemgetter(*label_order)
+
+_extract_label_values = _make_label_extractor(_LABEL_ORDER)
+
+def _label_values(container_data):
+    """Return the metric label values of partial container data, defaulting missing labels."""
+    return tuple(container_data.get(label_name, '') for label_name in _LABEL_ORDER)
+
+def _empty_result(container_id):
+    """
+    Build the minimal health data used when a container cannot be read.
+
+    Args:
+        container_id (str): Short container ID
+
+    Returns:
+        dict: Health data reporting no health check
+    """
+    result = {
+        'container_id': container_id,
+        'health_status': 'none',
+        'health_status_code': HEALTH_STATUS['none'],
+        'failure_streak': 0
+    }
+    result['label_values'] = _label_values(result)
+    return result
+
+class _SingleFamily:
+    """Registry stand-in that exposes one already collected metric family."""
+
+    def __init__(self, metric):
+        self.metric = metric
+
+    def collect(self):
+        return [self.metric]
+
+def _stream_latest(registry):
+    """
+    Render the registry in the latest text format one metric family at a time.
+
+    Args:
+        registry: Prometheus registry to collect from
+
+    Yields:
+        bytes: Exposition text for a single metric family
+    """
+    for metric in registry.collect():
+        yield generate_latest(_SingleFamily(metric))
+
+class DockerHealthCollector(Collector):
     """Collector for Docker container health metrics."""
 
-    def __init__(self, poll_interval=15):
+    def __init__(self, poll_interval=15, inspect_concurrency=16):
         """
         Initialize the Docker health collector.
 
         Args:
             poll_interval (int): Interval in seconds to poll Docker API
+            inspect_concurrency (int): Maximum number of containers inspected in parallel
         """
         self.poll_interval = poll_interval
+        self.inspect_concurrency = inspect_concurrency
+        self._pool = self._new_pool()
         self.docker_client = None
-        self.running = False
+        # Set to stop the background threads; waiting on it keeps shutdown prompt.
+        # Each start_polling replaces it with a new event for its own threads.
+        self._stop = threading.Event()
+        self._threads = []
+        self._events = None
+        # Health data for monitored containers, keyed by container ID. The dict is
+        # replaced rather than mutated, so scrapes can read it without locking;
+        # the lock only serialises writers.
+        self._state: dict[str, dict] = {}
+        self._state_lock = threading.Lock()
+        # Containers changed by events since the running resync listed containers;
+        # their event data is newer than the resync's and is kept when it swaps in
+        self._touched: set[str] = set()
+        # Serialises the resyncs run by the events and reconciliation threads
+        self._seed_lock = threading.Lock()
+        # Metric families last built from the state, paired with that state
+        self._rendered = (None, ())
+        # Image label values keyed by image ID, dropped on every resync so retags show up
+        self._image_names: dict[str, str] = {}
+
+    def _new_pool(self):
+        """Create the executor that inspects containers during a resync."""
+        # Worker threads are only spawned on submit, so an unused pool costs nothing
+        return ThreadPoolExecutor(max_workers=self.inspect_concurrency, thread_name_prefix='inspect')
 
     def connect_to_docker(self):
         """Establish connection to Docker API."""
         try:
-            self.docker_client = docker.from_env()
+            # Size the connection pool so every inspect worker, the events stream and
+            # the resync listing can each hold a kept-alive socket instead of reconnecting
+            self.docker_client = docker.from_env(max_pool_size=self.inspect_concurrency + 2)
             logger.info("Successfully connected to Docker API")
             return True
         except Exception as e:
@@ -102,55 +219,87 @@ class DockerHealthCollector:
         Determine if a container should be monitored based on labels.
 
         Args:
-            container: Docker container object
+            container (dict): Container summary from the Docker API list call
 
         Returns:
             bool: True if the container should be monitored, False otherwise
         """
         try:
             # Get container labels
-            labels = container.attrs.get('Config', {}).get('Labels', {})
-            container_name = container.name if hasattr(container, 'name') else 'unknown'
+            labels = container.get('Labels') or {}
+            container_name = _container_name(container)
 
             # Check if container is explicitly opted out
             if labels.get('prometheus.health.enabled', '').lower() == 'false':
-                logger.debug(f"Container {container_name} opted out of monitoring via label")
+                logger.debug("Container %s opted out of monitoring via label", container_name)
                 return False
 
             # If OPT_IN_ONLY is true, check if container is explicitly opted in
             if OPT_IN_ONLY and labels.get('prometheus.health.enabled', '').lower() != 'true':
-                logger.debug(f"Container {container_name} not monitored - OPT_IN_ONLY mode and not opted in")
+                logger.debug("Container %s not monitored - OPT_IN_ONLY mode and not opted in", container_name)
                 return False
 
             return True
         except Exception as e:
-            logger.error(f"Error determining monitoring status for container: {e}")
+            logger.error("Error determining monitoring status for container: %s", e)
             return False
 
+    def _image_name(self, image_id):
+        """
+        Resolve the image label value of a container from its image ID.
+
+        Reports the image's first tag, or the start of its ID when it is untagged
+        or cannot be inspected, and caches the result so each image is only
+        inspected once per resync.
+
+        Args:
+            image_id (str): Image ID from the container summary
+
+        Returns:
+            str: Image label value, e.g. nginx:latest
+        """
+        image_names = self._image_names
+        image_name = image_names.get(image_id)
+        if image_name is None:
+            try:
+                image = self.docker_client.api.inspect_image(image_id)
+            except docker.errors.APIError as e:
+                # e.g. the image was force-removed while the container runs; not
+                # cached so the tag is looked up again once the image is back
+                logger.debug("Could not inspect image %s: %s", image_id, e)
+                return image_id[:12]
+            # Untagged images may list a '<none>:<none>' placeholder tag
+            tags = [tag for tag in image.get('RepoTags') or [] if tag != '<none>:<none>']
+            image_name = tags[0] if tags else image_id[:12]
+            image_names[image_id] = image_name
+        return image_name
+
     def get_container_health(self, container):
         """
         Get health status of a container.
 
+        The list summary carries the name and labels, so the container is only
+        inspected when its status shows a health check.
+
         Args:
-            container: Docker container object
+            container (dict): Container summary from the Docker API list call
 
         Returns:
             dict: Dictionary with all container metadata and labels
         """
-        result = {}
+        # Read the ID once, the full ID is needed for the inspect call
+        full_id = container.get('Id', 'unknown')
+        container_id = full_id[:12]  # Short ID
 
         try:
             # Extract basic container information
-            container_id = container.id[:12] if hasattr(container, 'id') else 'unknown'  # Short ID
-            container_name = container.name if hasattr(container, 'name') else 'unknown'
-
-            if hasattr(container, 'image'):
-                image_name = container.image.tags[0] if hasattr(container.image, 'tags') and container.image.tags else container.image.id[:12]
-            else:
-                image_name = 'unknown'
+            container_name = container['Names'][0].lstrip('/')
+            # The summary's Image is the reference as typed (or a bare ID once the
+            # tag moved), so resolve the tag from the image itself
+            image_name = self._image_name(container['ImageID'])
 
             # Get all container labels
-            labels = container.attrs.get('Config', {}).get('Labels', {}) if hasattr(container, 'attrs') else {}
+            labels = container['Labels'] or {}
 
             # Extract compose stack and service labels
             stack = labels.get('com.docker.compose.project', '')
@@ -165,10 +314,12 @@ class DockerHealthCollector:
             # Check if container has health check
             health_status = 'none'
             failure_streak = 0
-            if hasattr(container, 'attrs') and 'Health' in container.attrs.get('State', {}):
-                health_info = container.attrs['State']['Health']
-                health_status = health_info['Status']
-                failure_streak = health_info.get('FailingStreak', 0)
+            # The summary status reads e.g. "Up 5 minutes (healthy)" when a health check is configured
+            if 'health' in container['Status']:
+                health = self.docker_client.api.inspect_container(full_id)['State'].get('Health')
+                if health:
+                    health_status = health['Status']
+                    failure_streak = health['FailingStreak']
 
             # Store all values in result dictionary, even if we're not using default labels
             # This makes it easier to access health status and failure streak values
@@ -179,97 +330,282 @@ class DockerHealthCollector:
                 'stack': stack,
                 'service': service,
                 'health_status': health_status,
+                # Resolved once here so scrapes do not repeat the lookup
+                'health_status_code': HEALTH_STATUS.get(health_status, 3),
                 'failure_streak': failure_streak
             }
 
             # Get custom label mappings from container labels
-            for container_label, metric_label in LABEL_MAPPINGS.items():
-                result[metric_label] = labels.get(container_label, '')
-                logger.debug(f"Mapped container label {container_label} to metric label {metric_label}: {result[metric_label]}")
+            if _HAS_CUSTOM_LABELS:
+                for container_label, metric_label in _LABEL_MAP_ITEMS:
+                    result[metric_label] = labels.get(container_label, '')
+                    logger.debug("Mapped container label %s to metric label %s: %s",
+                                 container_label, metric_label, result[metric_label])
+
+        except (KeyError, IndexError, TypeError) as e:
+            logger.error("Unexpected container data for %s: %r", container_id, e)
+            return _empty_result(container_id)
+
+        # Built once per update so scrapes can pass the values straight through
+        result['label_values'] = _extract_label_values(result)
+        return result
 
-        except Exception as e:
-            logger.error(f"Error getting container health info: {e}")
-            # Ensure we have minimal fields for metrics
-            result = {
-                'container_id': getattr(container, 'id', 'unknown')[:12] if hasattr(container, 'id') else 'unknown',
-                'health_status': 'none',
-                'failure_streak': 0
-            }
+    def _process_one(self, container):
+        """
+        Collect health data for a single container from the listing.
 
-        return result
+        Args:
+            container (dict): Container summary from the Docker API list call
 
-    def update_metrics(self):
-        """Update Prometheus metrics with current container health statuses."""
-        if not self.docker_client:
-            if not self.connect_to_docker():
-                logger.warning("Skipping metrics update due to Docker connection failure")
-                return
+        Returns:
+            dict: Container health data, or None if the container is not monitored
 
+        Raises:
+            docker.errors.APIError: If the Docker API could not be read for the container
+        """
         try:
-            # Get all running containers
-            if self.docker_client and hasattr(self.docker_client, 'containers'):
-                containers = self.docker_client.containers.list(all=False)
-
-                # Update health metrics for each container
-                for container in containers:
-                    try:
-                        # Get container name for logging
-                        container_name = container.name if hasattr(container, 'name') else str(container.id)[:12]
+            # Check if this container should be monitored based on labels
+            if not self.should_monitor_container(container):
+                # The name is only worth parsing if the message is emitted
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Skipping container %s based on monitoring policy", _container_name(container))
+                return None
+
+            return self.get_container_health(container)
+        except docker.errors.APIError:
+            # Left to _seed_state, which keeps the container's previous state
+            raise
+        except Exception as e:
+            logger.error("Error processing container %s: %s", container.get('Id', 'unknown')[:12], e)
+            return None
+
+    def _seed_state(self):
+        """Rebuild the container state from a full listing of running containers."""
+        with self._seed_lock:
+            # Re-resolve image tags, they can move between images
+            self._image_names = {}
+            with self._state_lock:
+                self._touched = set()
+            containers = self.docker_client.api.containers(all=False, filters=_build_filters())
+
+            # Inspect in parallel so one slow container does not hold up the rest
+            futures = {self._pool.submit(self._process_one, container): container['Id'] for container in containers}
+            done, not_done = wait(futures, timeout=self.poll_interval * 0.8)
+
+            state = {}
+            # Containers that could not be read this time keep their previous state
+            kept = []
+            for future in done:
+                container_id = futures[future]
+                try:
+                    container_data = future.result()
+                except docker.errors.APIError as e:
+                    logger.warning("Docker API error for container %s, keeping its previous state: %s",
+                                   container_id[:12], e)
+                    kept.append(container_id)
+                    continue
+                if container_data is not None:
+                    state[container_id] = container_data
+
+            with self._state_lock:
+                if not_done:
+                    logger.warning("%d containers did not respond in time, keeping their previous state", len(not_done))
+                    for future in not_done:
+                        future.cancel()
+                        kept.append(futures[future])
+                for container_id in kept:
+                    if container_id in self._state:
+                        state[container_id] = self._state[container_id]
+                # Events handled during the resync win over what it read
+                for container_id in self._touched:
+                    if container_id in self._state:
+                        state[container_id] = self._state[container_id]
+                    else:
+                        state.pop(container_id, None)
+                if state != self._state:
+                    self._state = state
+            logger.debug("Reconciled state for %d containers", len(state))
+
+    def _refresh_container(self, container_id):
+        """Re-read a single container and update its cached state."""
+        filters = _build_filters() or {}
+        filters['id'] = [container_id]
+        containers = self.docker_client.api.containers(all=False, filters=filters)
+        if not containers or not self.should_monitor_container(containers[0]):
+            self._forget_container(container_id)
+            return
+
+        container_data = self.get_container_health(containers[0])
+        with self._state_lock:
+            self._touched.add(container_id)
+            # Most events do not change what is reported, keep the published state then
+            if self._state.get(container_id) == container_data:
+                return
+            state = dict(self._state)
+            state[container_id] = container_data
+            self._state = state
+
+    def _forget_container(self, container_id):
+        """Drop a container from the cached state."""
+        with self._state_lock:
+            self._touched.add(container_id)
+            if container_id in self._state:
+                state = dict(self._state)
+                del state[container_id]
+                self._state = state
+
+    def handle_event(self, event):
+        """
+        Apply a Docker container event to the cached state.
 
-                        # Check if this container should be monitored based on labels
-                        if not self.should_monitor_container(container):
-                            logger.debug(f"Skipping container {container_name} based on monitoring policy")
-                            continue
+        Args:
+            event (dict): Decoded event from the Docker events stream
+        """
+        container_id = event.get('id') or event.get('Actor', {}).get('ID')
+        action = event.get('Action', '')
+        if not container_id:
+            return
+
+        logger.debug("Received %s event for container %s", action, container_id[:12])
+        if action in ('die', 'destroy'):
+            self._forget_container(container_id)
+        else:
+            # start and health_status events: fetch the current health and streak
+            self._refresh_container(container_id)
 
-                        # Get container health data including any custom labels
-                        container_data = self.get_container_health(container)
+    def collect(self):
+        """Build the health metrics from the cached container state at scrape time."""
+        # The published state is never mutated, so no lock or copy is needed
+        state = self._state
 
-                        # Prepare label dictionary for Prometheus metrics
-                        metric_labels = {}
-                        for label_name in ALL_LABELS:
-                            metric_labels[label_name] = container_data.get(label_name, '')
+        # Only rebuild the families when the state was replaced since the last scrape
+        rendered_state, families = self._rendered
+        if rendered_state is not state:
+            families = self._build_families(state.values())
+            self._rendered = (state, families)
 
-                        # Update health status metric with all labels
-                        CONTAINER_HEALTH.labels(**metric_labels).set(HEALTH_STATUS.get(container_data['health_status'], 3))
+        yield from families
 
-                        # Update failure streak metric with all labels
-                        HEALTH_FAILURE_STREAK.labels(**metric_labels).set(container_data['failure_streak'])
+    def describe(self):
+        """Describe the metrics so the registry can reject duplicate registration."""
+        return list(self._build_families(()))
 
-                        # Log basic info and indicate if custom labels were used
-                        extra_labels = ""
-                        if LABEL_MAPPINGS:
-                            extra_labels = ", with custom labels"
+    def _build_families(self, containers):
+        """
+        Build the health status and failure streak metric families in one pass.
 
-                        logger.debug(f"Container {container_data['container_name']} ({container_data['container_id']}) "
-                                     f"health: {container_data['health_status']}, "
-                                     f"failure streak: {container_data['failure_streak']}{extra_labels}")
-                    except Exception as e:
-                        container_id = getattr(container, 'id', 'unknown')[:12] if hasattr(container, 'id') else 'unknown'
-                        logger.error(f"Error processing container {container_id}: {e}")
-            else:
-                logger.error("Docker client is not properly initialized or missing containers attribute")
+        Args:
+            containers (iterable): Cached health data of the monitored containers
 
-        except Exception as e:
-            logger.error(f"Error updating metrics: {e}")
+        Returns:
+            tuple: Health status and failure streak GaugeMetricFamily, one sample per distinct label set
+        """
+        health_family = GaugeMetricFamily(
+            'docker_container_health_status',
+            'Health status of Docker containers with health checks (0=unhealthy, 1=healthy, 2=starting, 3=no health check)',
+            labels=_LABEL_ORDER
+        )
+        streak_family = GaugeMetricFamily(
+            'docker_container_health_failure_streak',
+            'Number of consecutive health check failures for Docker containers',
+            labels=_LABEL_ORDER
+        )
+
+        # Containers can share label values (e.g. with NO_DEFAULT_LABELS), the last one wins
+        samples = {}
+        # Checked once per build, the per-container log arguments are not free
+        debug = logger.isEnabledFor(logging.DEBUG)
+        # Indicate in the log if custom labels were used
+        extra_labels = ", with custom labels" if _HAS_CUSTOM_LABELS else ""
+        for container_data in containers:
+            samples[container_data['label_values']] = (container_data['health_status_code'],
+                                                       container_data['failure_streak'])
+
+            if debug:
+                logger.debug("Container %s (%s) health: %s, failure streak: %s%s",
+                             container_data.get('container_name', 'unknown'), container_data['container_id'],
+                             container_data['health_status'], container_data['failure_streak'], extra_labels)
+
+        for label_values, (health_status_code, failure_streak) in samples.items():
+            health_family.add_metric(label_values, health_status_code)
+            streak_family.add_metric(label_values, failure_streak)
+        return health_family, streak_family
 
     def start_polling(self):
-        """Start polling Docker API in a separate thread."""
-        def poll_loop():
-            logger.info(f"Starting polling thread with interval of {self.poll_interval} seconds")
-            while self.running:
+        """Start watching Docker events and reconciling container state in separate threads."""
+        # Each start gets its own stop event, so threads left over from a previous
+        # start still see theirs set and exit instead of running alongside the new ones
+        self._stop = stop = threading.Event()
+
+        def events_loop():
+            logger.info("Starting Docker events thread")
+            while not stop.is_set():
+                if not self.docker_client and not self.connect_to_docker():
+                    logger.warning(f"Retrying Docker connection in {self.poll_interval} seconds")
+                    stop.wait(self.poll_interval)
+                    continue
+
+                events = None
                 try:
-                    self.update_metrics()
+                    events = self._events = self.docker_client.events(decode=True, filters=EVENT_FILTERS)
+                    # stop_polling may have run before the stream was published
+                    if stop.is_set():
+                        events.close()
+                        break
+                    # Seed after subscribing so no transition is missed in between
+                    self._seed_state()
+                    for event in events:
+                        try:
+                            self.handle_event(event)
+                        except Exception as e:
+                            logger.error("Error handling Docker event: %s", e)
                 except Exception as e:
-                    logger.error(f"Error in polling thread: {e}")
-                time.sleep(self.poll_interval)
-
-        self.running = True
-        polling_thread = threading.Thread(target=poll_loop, daemon=True)
-        polling_thread.start()
+                    if not stop.is_set():
+                        logger.error(f"Error in events thread: {e}")
+                        # Close the stream before resubscribing, a failed seed would leak it
+                        if events is not None:
+                            self._close_events(events)
+                        stop.wait(self.poll_interval)
+
+        def reconcile_loop():
+            logger.info(f"Starting reconciliation thread with interval of {self.poll_interval} seconds")
+            # Schedule against fixed deadlines so resync time does not add up as drift
+            deadline = time.monotonic() + self.poll_interval
+            while not stop.wait(max(0, deadline - time.monotonic())):
+                if self.docker_client:
+                    try:
+                        self._seed_state()
+                    except Exception as e:
+                        logger.error(f"Error in reconciliation thread: {e}")
+
+                # Skip slots already missed by a resync that overran the interval
+                deadline += self.poll_interval
+                now = time.monotonic()
+                if deadline < now:
+                    deadline = now + self.poll_interval
+
+        # stop_polling shuts the pool down, so every start gets a new one
+        self._pool = self._new_pool()
+        self._threads = [
+            threading.Thread(target=events_loop, daemon=True),
+            threading.Thread(target=reconcile_loop, daemon=True)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _close_events(self, events):
+        """Close a Docker events stream, which may already have ended."""
+        try:
+            events.close()
+        except Exception as e:
+            logger.debug("Error closing Docker events stream: %s", e)
 
     def stop_polling(self):
-        """Stop the polling thread."""
-        self.running = False
+        """Stop the events and reconciliation threads."""
+        self._stop.set()
+        if self._events is not None:
+            self._close_events(self._events)
+        self._pool.shutdown(wait=False, cancel_futures=True)
 
 def create_app():
     """Create and configure the Flask application."""
@@ -277,9 +613,13 @@ def create_app():
 
     # Create and start the Docker health collector
     collector = DockerHealthCollector(
-        poll_interval=int(os.environ.get("POLL_INTERVAL", "15"))
+        poll_interval=int(os.environ.get("POLL_INTERVAL", "15")),
+        inspect_concurrency=int(os.environ.get("INSPECT_CONCURRENCY", "16"))
     )
+    # Register first so a failed registration does not leave the threads running
+    REGISTRY.register(collector)
     collector.start_polling()
+    app.extensions['docker_health_collector'] = collector
 
     @app.route('/')
     def index():
@@ -299,7 +639,8 @@ def create_app():
     @app.route('/metrics')
     def metrics():
         """Expose Prometheus metrics endpoint."""
-        return Response(generate_latest(REGISTRY), mimetype=CONTENT_TYPE_LATEST)
+        # Stream the families so the whole exposition is never held in memory at once
+        return Response(_stream_latest(REGISTRY), content_type=CONTENT_TYPE_LATEST, direct_passthrough=True)
 
     @app.route('/health')
     def health():
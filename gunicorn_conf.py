@@ -0,0 +1,16 @@
+"""
+Gunicorn configuration for the Docker Healthcheck Exporter.
+"""
+
+bind = "0.0.0.0:5000"
+reuse_port = True
+
+# A single worker owns the collector and its container state, threads let it
+# serve concurrent scrapes. More workers would each watch Docker separately.
+workers = 1
+worker_class = "gthread"
+threads = 8
+
+# The collector starts its background threads when the app is created; threads
+# started in a preloading master would not survive the fork into the worker.
+preload_app = False
@@ -1,220 +1,429 @@
-import unittest
+import threading
+import docker
 from unittest.mock import patch, MagicMock
-from docker_health_exporter import DockerHealthCollector, HEALTH_STATUS
-
-class TestDockerHealthCollector(unittest.TestCase):
-    """Test case for the DockerHealthCollector class."""
-
-    def setUp(self):
-        """Set up the test environment before each test."""
-        # Create a collector with mocked Docker client
-        self.patcher = patch('docker_health_exporter.docker.from_env')
-        self.mock_docker = self.patcher.start()
-        self.mock_client = MagicMock()
-        self.mock_docker.return_value = self.mock_client
-
-        # Create the collector
-        self.collector = DockerHealthCollector()
-
-    def tearDown(self):
-        """Tear down the test environment after each test."""
-        self.patcher.stop()
-
-    def test_connect_to_docker_success(self):
-        """Test connecting to Docker API successfully."""
-        # Configure the mock to return successfully
-        self.mock_docker.return_value = self.mock_client
-
-        # Call the method
-        result = self.collector.connect_to_docker()
-
-        # Check the result
-        self.assertTrue(result)
-        self.assertEqual(self.collector.docker_client, self.mock_client)
-
-    def test_connect_to_docker_failure(self):
-        """Test connecting to Docker API with failure."""
-        # Configure the mock to raise an exception
-        self.mock_docker.side_effect = Exception("Connection failed")
-
-        # Call the method
-        result = self.collector.connect_to_docker()
-
-        # Check the result
-        self.assertFalse(result)
-        self.assertIsNone(self.collector.docker_client)
-
-    def test_should_monitor_container_opt_in_only_false(self):
-        """Test should_monitor_container with OPT_IN_ONLY=False."""
-        # Create a mock container
-        mock_container = MagicMock()
-
-        # Configure the container's attributes
-        mock_container.attrs = {
-            'Config': {
-                'Labels': {}
-            }
-        }
-
-        # Test with a container with no labels (should be monitored)
-        with patch('docker_health_exporter.OPT_IN_ONLY', False):
-            result = self.collector.should_monitor_container(mock_container)
-            self.assertTrue(result)
-
-        # Test with a container explicitly opted out
-        mock_container.attrs['Config']['Labels'] = {
-            'prometheus.health.enabled': 'false'
+import pytest
+from docker_health_exporter import DockerHealthCollector, HEALTH_STATUS, _build_filters, _make_label_extractor
+
+@pytest.fixture
+def mock_docker():
+    """Patch docker.from_env for the collector under test."""
+    with patch('docker_health_exporter.docker.from_env') as mock_docker:
+        yield mock_docker
+
+@pytest.fixture
+def mock_client(mock_docker):
+    """Return the Docker client handed out by the patched docker.from_env."""
+    mock_client = MagicMock()
+    mock_docker.return_value = mock_client
+    return mock_client
+
+@pytest.fixture
+def collector(mock_client):
+    """Create the collector under test."""
+    return DockerHealthCollector()
+
+def test_connect_to_docker_success(collector, mock_client, mock_docker):
+    """Test connecting to Docker API successfully."""
+    # Configure the mock to return successfully
+    mock_docker.return_value = mock_client
+
+    # Call the method
+    result = collector.connect_to_docker()
+
+    # Check the result
+    assert result
+    assert collector.docker_client == mock_client
+
+    # The connection pool must fit the inspect workers plus the events stream
+    mock_docker.assert_called_once_with(max_pool_size=collector.inspect_concurrency + 2)
+
+def test_connect_to_docker_failure(collector, mock_docker):
+    """Test connecting to Docker API with failure."""
+    # Configure the mock to raise an exception
+    mock_docker.side_effect = Exception("Connection failed")
+
+    # Call the method
+    result = collector.connect_to_docker()
+
+    # Check the result
+    assert not result
+    assert collector.docker_client is None
+
+def test_should_monitor_container_opt_in_only_false(collector):
+    """Test should_monitor_container with OPT_IN_ONLY=False."""
+    # Create a container summary
+    mock_container = {
+        'Names': ['/test-container'],
+        'Labels': {}
+    }
+
+    # Test with a container with no labels (should be monitored)
+    with patch('docker_health_exporter.OPT_IN_ONLY', False):
+        result = collector.should_monitor_container(mock_container)
+        assert result
+
+    # Test with a container explicitly opted out
+    mock_container['Labels'] = {
+        'prometheus.health.enabled': 'false'
+    }
+    with patch('docker_health_exporter.OPT_IN_ONLY', False):
+        result = collector.should_monitor_container(mock_container)
+        assert not result
+
+def test_should_monitor_container_opt_in_only_true(collector):
+    """Test should_monitor_container with OPT_IN_ONLY=True."""
+    # Create a container summary
+    mock_container = {
+        'Names': ['/test-container'],
+        'Labels': {}
+    }
+
+    # Test with a container with no labels (should not be monitored)
+    with patch('docker_health_exporter.OPT_IN_ONLY', True):
+        result = collector.should_monitor_container(mock_container)
+        assert not result
+
+    # Test with a container explicitly opted in
+    mock_container['Labels'] = {
+        'prometheus.health.enabled': 'true'
+    }
+    with patch('docker_health_exporter.OPT_IN_ONLY', True):
+        result = collector.should_monitor_container(mock_container)
+        assert result
+
+    # The label value is matched regardless of case
+    mock_container['Labels'] = {
+        'prometheus.health.enabled': 'True'
+    }
+    with patch('docker_health_exporter.OPT_IN_ONLY', True):
+        result = collector.should_monitor_container(mock_container)
+        assert result
+
+def test_build_filters():
+    """Test OPT_IN_ONLY pushes the opt-in label key filter to the Docker daemon."""
+    with patch('docker_health_exporter.OPT_IN_ONLY', False):
+        assert _build_filters() is None
+
+    with patch('docker_health_exporter.OPT_IN_ONLY', True):
+        assert _build_filters() == {'label': ['prometheus.health.enabled']}
+
+def test_make_label_extractor():
+    """Test the label extractor returns a tuple in label order for any label count."""
+    container_data = {'container_id': 'abc123', 'container_name': 'web', 'team': 'devops'}
+
+    assert _make_label_extractor(('team', 'container_id'))(container_data) == ('devops', 'abc123')
+    assert _make_label_extractor(('container_id',))(container_data) == ('abc123',)
+
+def test_get_container_health(collector, mock_client):
+    """Test get_container_health retrieves and processes container health data."""
+    # Create a container summary with a health check
+    mock_container = {
+        'Id': 'abc123def456789',
+        'Names': ['/test-container'],
+        'Image': 'nginx',
+        'ImageID': 'sha256:4e1b6bae1e48',
+        'Status': 'Up 5 minutes (healthy)',
+        'Labels': {
+            'com.docker.compose.project': 'testproject',
+            'com.docker.compose.service': 'web',
+            'com.example.team': 'devops'
         }
-        with patch('docker_health_exporter.OPT_IN_ONLY', False):
-            result = self.collector.should_monitor_container(mock_container)
-            self.assertFalse(result)
-
-    def test_should_monitor_container_opt_in_only_true(self):
-        """Test should_monitor_container with OPT_IN_ONLY=True."""
-        # Create a mock container
-        mock_container = MagicMock()
-
-        # Configure the container's attributes
-        mock_container.attrs = {
-            'Config': {
-                'Labels': {}
+    }
+
+    # Health details are only available by inspecting the container
+    mock_client.api.inspect_container.return_value = {
+        'State': {
+            'Health': {
+                'Status': 'healthy',
+                'FailingStreak': 0
             }
         }
-
-        # Test with a container with no labels (should not be monitored)
-        with patch('docker_health_exporter.OPT_IN_ONLY', True):
-            result = self.collector.should_monitor_container(mock_container)
-            self.assertFalse(result)
-
-        # Test with a container explicitly opted in
-        mock_container.attrs['Config']['Labels'] = {
-            'prometheus.health.enabled': 'true'
+    }
+    # The image label is the image's first tag
+    mock_client.api.inspect_image.return_value = {'RepoTags': ['nginx:latest', 'nginx:1.27']}
+    collector.docker_client = mock_client
+
+    # Test with default settings
+    result = collector.get_container_health(mock_container)
+    mock_client.api.inspect_container.assert_called_once_with('abc123def456789')
+
+    # Check result contains the expected values
+    assert result['container_id'] == 'abc123def456'
+    assert result['container_name'] == 'test-container'
+    assert result['image'] == 'nginx:latest'
+    assert result['stack'] == 'testproject'
+    assert result['service'] == 'web'
+    assert result['health_status'] == 'healthy'
+    assert result['health_status_code'] == HEALTH_STATUS['healthy']
+    assert result['failure_streak'] == 0
+    assert result['label_values'] == ('abc123def456', 'test-container', 'nginx:latest', 'testproject', 'web')
+
+    # Test with custom label mappings
+    with patch('docker_health_exporter._LABEL_MAP_ITEMS', (('com.example.team', 'team'),)), \
+         patch('docker_health_exporter._HAS_CUSTOM_LABELS', True):
+        result = collector.get_container_health(mock_container)
+        assert result['team'] == 'devops'
+
+    # Without mappings no custom labels are added
+    assert 'team' not in collector.get_container_health(mock_container)
+
+    # The image tag is resolved once and reused
+    mock_client.api.inspect_image.assert_called_once_with('sha256:4e1b6bae1e48')
+
+    # A missing image only loses the tag, the container is still reported
+    mock_client.api.inspect_image.side_effect = docker.errors.NotFound("No such image")
+    collector._image_names = {}
+    result = collector.get_container_health(mock_container)
+    assert result['image'] == 'sha256:4e1b6'
+    assert result['health_status'] == 'healthy'
+
+def test_get_container_health_no_health_check(collector, mock_client):
+    """Test get_container_health with a container that has no health check."""
+    # Create a container summary without health check
+    mock_container = {
+        'Id': 'abc123def456789',
+        'Names': ['/test-container'],
+        'Image': 'sha256:5d0da3dc9764',
+        'ImageID': 'sha256:5d0da3dc9764',
+        'Status': 'Up 5 minutes',
+        'Labels': {
+            'com.docker.compose.project': 'testproject',
+            'com.docker.compose.service': 'web'
         }
-        with patch('docker_health_exporter.OPT_IN_ONLY', True):
-            result = self.collector.should_monitor_container(mock_container)
-            self.assertTrue(result)
-
-    def test_get_container_health(self):
-        """Test get_container_health retrieves and processes container health data."""
-        # Create a mock container
-        mock_container = MagicMock()
-        mock_container.id = "abc123def456"
-        mock_container.name = "test-container"
-        mock_container.image.tags = ["nginx:latest"]
-
-        # Configure container attributes with health check
-        mock_container.attrs = {
-            'Config': {
-                'Labels': {
-                    'com.docker.compose.project': 'testproject',
-                    'com.docker.compose.service': 'web',
-                    'com.example.team': 'devops'
-                }
-            },
-            'State': {
-                'Health': {
-                    'Status': 'healthy',
-                    'FailingStreak': 0
-                }
-            }
+    }
+    # An untagged image is reported by the start of its ID
+    mock_client.api.inspect_image.return_value = {'RepoTags': ['<none>:<none>']}
+    collector.docker_client = mock_client
+
+    # Get container health
+    result = collector.get_container_health(mock_container)
+
+    # No inspect is needed when the summary shows no health check
+    mock_client.api.inspect_container.assert_not_called()
+
+    # Check result has the correct default values
+    assert result['image'] == 'sha256:5d0da'
+    assert result['health_status'] == 'none'
+    assert result['health_status_code'] == HEALTH_STATUS['none']
+    assert result['failure_streak'] == 0
+
+def test_get_container_health_malformed_data(collector):
+    """Test get_container_health falls back to minimal data for an unexpected summary."""
+    result = collector.get_container_health({'Id': 'abc123def456789'})
+
+    assert result == {
+        'container_id': 'abc123def456',
+        'health_status': 'none',
+        'health_status_code': HEALTH_STATUS['none'],
+        'failure_streak': 0,
+        'label_values': ('abc123def456', '', '', '', '')
+    }
+
+def test_seed_state(collector, mock_client):
+    """Test _seed_state caches health data for monitored containers only."""
+    # Mock the containers list
+    mock_container1 = {'Id': 'container1', 'Names': ['/test-container-1']}
+    mock_container2 = {'Id': 'container2', 'Names': ['/test-container-2']}
+
+    mock_client.api.containers.return_value = [mock_container1, mock_container2]
+    collector.docker_client = mock_client
+
+    # Mock the should_monitor_container method
+    with patch.object(collector, 'should_monitor_container') as mock_should_monitor:
+        # First container should be monitored, second one not
+        mock_should_monitor.side_effect = lambda container: container['Id'] == 'container1'
+
+        # Mock the get_container_health method
+        with patch.object(collector, 'get_container_health') as mock_get_health:
+            mock_get_health.return_value = {'container_id': 'container1', 'health_status': 'healthy'}
+
+            collector._seed_state()
+
+            # Verify methods called correctly
+            mock_client.api.containers.assert_called_once_with(all=False, filters=None)
+            assert mock_should_monitor.call_count == 2
+            mock_get_health.assert_called_once_with(mock_container1)
+            assert list(collector._state) == ['container1']
+
+def test_seed_state_keeps_previous_state_on_timeout(collector, mock_client):
+    """Test _seed_state keeps cached data for containers that miss the deadline."""
+    release = threading.Event()
+
+    def slow_health(container):
+        if container['Id'] == 'slow':
+            release.wait(5)
+        return {'container_id': container['Id'], 'health_status': 'healthy'}
+
+    mock_client.api.containers.return_value = [{'Id': 'fast'}, {'Id': 'slow'}]
+    collector.docker_client = mock_client
+    collector.poll_interval = 0.1
+    collector._state = {'slow': {'container_id': 'slow', 'health_status': 'unhealthy'}}
+
+    try:
+        with patch.object(collector, 'should_monitor_container', return_value=True), \
+             patch.object(collector, 'get_container_health', side_effect=slow_health):
+            collector._seed_state()
+    finally:
+        release.set()
+
+    assert collector._state['fast']['health_status'] == 'healthy'
+    assert collector._state['slow']['health_status'] == 'unhealthy'
+
+def test_seed_state_keeps_previous_state_on_api_error(collector, mock_client):
+    """Test _seed_state keeps cached data for containers the Docker API failed to read."""
+    def flaky_health(container):
+        if container['Id'] == 'flaky':
+            raise docker.errors.APIError("Inspect failed")
+        return {'container_id': container['Id'], 'health_status': 'healthy'}
+
+    mock_client.api.containers.return_value = [{'Id': 'ok'}, {'Id': 'flaky'}]
+    collector.docker_client = mock_client
+    collector._state = {'flaky': {'container_id': 'flaky', 'health_status': 'unhealthy'}}
+
+    with patch.object(collector, 'should_monitor_container', return_value=True), \
+         patch.object(collector, 'get_container_health', side_effect=flaky_health):
+        collector._seed_state()
+
+    assert collector._state['ok']['health_status'] == 'healthy'
+    assert collector._state['flaky']['health_status'] == 'unhealthy'
+
+def test_seed_state_keeps_event_updates(collector, mock_client):
+    """Test _seed_state does not overwrite events handled while it was running."""
+    def health_during_event(container):
+        # A container stops while the resync is still inspecting
+        collector.handle_event({'id': 'container1', 'Action': 'die'})
+        return {'container_id': container['Id'], 'health_status': 'healthy'}
+
+    mock_client.api.containers.return_value = [{'Id': 'container1'}]
+    collector.docker_client = mock_client
+    collector._state = {'container1': {'container_id': 'container1', 'health_status': 'healthy'}}
+
+    with patch.object(collector, 'should_monitor_container', return_value=True), \
+         patch.object(collector, 'get_container_health', side_effect=health_during_event):
+        collector._seed_state()
+
+    assert 'container1' not in collector._state
+
+def test_stop_polling_interrupts_waits(collector, mock_client):
+    """Test stop_polling ends the background threads without waiting out the interval."""
+    mock_client.events.side_effect = Exception("Events unavailable")
+    collector.poll_interval = 60
+
+    collector.start_polling()
+    collector.stop_polling()
+
+    for thread in collector._threads:
+        thread.join(timeout=2)
+        assert not thread.is_alive()
+
+def test_failed_seed_closes_events_stream(collector, mock_client):
+    """Test the events thread closes its stream when seeding fails before resubscribing."""
+    closed = threading.Event()
+    mock_client.events.return_value.close.side_effect = closed.set
+    mock_client.api.containers.side_effect = Exception("Listing failed")
+    collector.poll_interval = 60
+
+    collector.start_polling()
+    try:
+        assert closed.wait(2)
+    finally:
+        collector.stop_polling()
+
+def test_restart_polling(collector, mock_client):
+    """Test a restart replaces the background threads and can resync again."""
+    mock_client.events.side_effect = Exception("Events unavailable")
+    collector.poll_interval = 60
+
+    collector.start_polling()
+    first_threads = collector._threads
+    collector.stop_polling()
+    collector.start_polling()
+    try:
+        # The threads of the first start exit rather than run alongside the new ones
+        for thread in first_threads:
+            thread.join(timeout=2)
+            assert not thread.is_alive()
+
+        mock_client.api.containers.return_value = [{'Id': 'container1'}]
+        collector.docker_client = mock_client
+        with patch.object(collector, 'get_container_health', return_value={'container_id': 'container1'}):
+            collector._seed_state()
+        assert list(collector._state) == ['container1']
+    finally:
+        collector.stop_polling()
+
+def test_handle_event(collector, mock_client):
+    """Test handle_event refreshes or drops containers from the cached state."""
+    mock_client.api.containers.return_value = [{'Id': 'container1'}]
+    collector.docker_client = mock_client
+
+    with patch.object(collector, 'should_monitor_container', return_value=True), \
+         patch.object(collector, 'get_container_health') as mock_get_health:
+        mock_get_health.return_value = {'container_id': 'container1', 'health_status': 'unhealthy'}
+
+        # A health transition re-inspects only the affected container
+        collector.handle_event({'id': 'container1', 'Action': 'health_status: unhealthy'})
+        mock_client.api.containers.assert_called_once_with(all=False, filters={'id': ['container1']})
+        assert collector._state['container1']['health_status'] == 'unhealthy'
+
+        # An event that changes nothing keeps the published state
+        published = collector._state
+        collector.handle_event({'id': 'container1', 'Action': 'health_status: unhealthy'})
+        assert collector._state is published
+
+        # A stopped container is dropped without any Docker API call
+        collector.handle_event({'id': 'container1', 'Action': 'die'})
+        assert mock_client.api.containers.call_count == 2
+        assert 'container1' not in collector._state
+
+        # State seen by an in-flight scrape is replaced, never mutated
+        assert 'container1' in published
+
+def test_collect(collector, mock_client):
+    """Test collect builds the metrics from the cached state without calling Docker."""
+    collector.docker_client = mock_client
+    collector._state = {
+        'container1': {
+            'container_id': 'container1',
+            'container_name': 'test-container-1',
+            'image': 'nginx:latest',
+            'stack': 'testproject',
+            'service': 'web',
+            'health_status': 'healthy',
+            'health_status_code': HEALTH_STATUS['healthy'],
+            'failure_streak': 0,
+            'label_values': ('container1', 'test-container-1', 'nginx:latest', 'testproject', 'web')
         }
-
-        # Test with default settings
-        result = self.collector.get_container_health(mock_container)
-
-        # Check result contains the expected values
-        self.assertEqual(result['container_id'], 'abc123def456')
-        self.assertEqual(result['container_name'], 'test-container')
-        self.assertEqual(result['image'], 'nginx:latest')
-        self.assertEqual(result['stack'], 'testproject')
-        self.assertEqual(result['service'], 'web')
-        self.assertEqual(result['health_status'], 'healthy')
-        self.assertEqual(result['failure_streak'], 0)
-
-        # Test with custom label mappings
-        with patch('docker_health_exporter.LABEL_MAPPINGS', {'com.example.team': 'team'}):
-            result = self.collector.get_container_health(mock_container)
-            self.assertEqual(result['team'], 'devops')
-
-    def test_get_container_health_no_health_check(self):
-        """Test get_container_health with a container that has no health check."""
-        # Create a mock container
-        mock_container = MagicMock()
-        mock_container.id = "abc123def456"
-        mock_container.name = "test-container"
-        mock_container.image.tags = ["nginx:latest"]
-
-        # Configure container attributes without health check
-        mock_container.attrs = {
-            'Config': {
-                'Labels': {
-                    'com.docker.compose.project': 'testproject',
-                    'com.docker.compose.service': 'web'
-                }
-            },
-            'State': {
-                # No Health key
-            }
-        }
-
-        # Get container health
-        result = self.collector.get_container_health(mock_container)
-
-        # Check result has the correct default values
-        self.assertEqual(result['health_status'], 'none')
-        self.assertEqual(result['failure_streak'], 0)
-
-    def test_update_metrics(self):
-        """Test update_metrics processes containers and updates metrics."""
-        # Mock the containers list
-        mock_container1 = MagicMock()
-        mock_container1.id = "container1"
-        mock_container1.name = "test-container-1"
-
-        mock_container2 = MagicMock()
-        mock_container2.id = "container2"
-        mock_container2.name = "test-container-2"
-
-        self.mock_client.containers.list.return_value = [mock_container1, mock_container2]
-
-        # Mock the should_monitor_container method
-        with patch.object(self.collector, 'should_monitor_container') as mock_should_monitor:
-            # First container should be monitored, second one not
-            mock_should_monitor.side_effect = [True, False]
-
-            # Mock the get_container_health method
-            with patch.object(self.collector, 'get_container_health') as mock_get_health:
-                mock_get_health.return_value = {
-                    'container_id': 'container1',
-                    'container_name': 'test-container-1',
-                    'image': 'nginx:latest',
-                    'stack': 'testproject',
-                    'service': 'web',
-                    'health_status': 'healthy',
-                    'failure_streak': 0
-                }
-
-                # Mock the metrics gauges
-                with patch('docker_health_exporter.CONTAINER_HEALTH') as mock_health_gauge, \
-                     patch('docker_health_exporter.HEALTH_FAILURE_STREAK') as mock_streak_gauge:
-
-                    # Configure the mock gauges
-                    mock_labels = MagicMock()
-                    mock_health_gauge.labels.return_value = mock_labels
-                    mock_streak_gauge.labels.return_value = mock_labels
-
-                    # Call update_metrics
-                    self.collector.update_metrics()
-
-                    # Verify methods called correctly
-                    self.mock_client.containers.list.assert_called_once_with(all=False)
-                    self.assertEqual(mock_should_monitor.call_count, 2)
-                    mock_get_health.assert_called_once_with(mock_container1)
-
-                    # Check that metrics were updated for the monitored container
-                    mock_health_gauge.labels.assert_called_once()
-                    mock_streak_gauge.labels.assert_called_once()
-                    mock_labels.set.assert_called_with(HEALTH_STATUS.get('unhealthy', 3))
-
-if __name__ == '__main__':
-    unittest.main()
+    }
+
+    health_family, streak_family = collector.collect()
+
+    # Verify no Docker API call happened on the scrape path
+    mock_client.api.containers.assert_not_called()
+
+    # Check that metrics were built for the cached container
+    expected_labels = {
+        'container_id': 'container1',
+        'container_name': 'test-container-1',
+        'image': 'nginx:latest',
+        'stack': 'testproject',
+        'service': 'web'
+    }
+    assert health_family.name == 'docker_container_health_status'
+    assert len(health_family.samples) == 1
+    assert health_family.samples[0].labels == expected_labels
+    assert health_family.samples[0].value == HEALTH_STATUS['healthy']
+
+    assert streak_family.name == 'docker_container_health_failure_streak'
+    assert streak_family.samples[0].labels == expected_labels
+    assert streak_family.samples[0].value == 0
+
+    # Unchanged state reuses the families built by the previous scrape
+    assert list(collector.collect()) == [health_family, streak_family]
+    assert next(collector.collect()) is health_family
+
+    # Containers that went away no longer produce a series
+    collector._state = {}
+    health_family, streak_family = collector.collect()
+    assert health_family.samples == []
+    assert streak_family.samples == []